@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""Check and repair broken widget metadata in Jupyter/Colab notebooks.
+
+Notebooks saved from Google Colab sometimes carry widget entries under
+``metadata.widgets`` that are missing the ``state`` key.  GitHub refuses to
+render such notebooks ("Invalid Notebook: the 'state' key is missing from
+'metadata.widgets'").  This script finds the offending widget entries and
+either reports them (--check) or fills in a minimal valid state (--fix).
+
+Usage:
+    python fix_notebook_metadata.py --check *.ipynb
+    python fix_notebook_metadata.py --fix --backup notebook.ipynb
+"""
+
+import argparse
+import atexit
+import functools
+import glob
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import orjson
+    _JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    orjson = None
+    _JSONDecodeError = json.JSONDecodeError
+
+WIDGET_STATE_KEY = 'application/vnd.jupyter.widget-state+json'
+CACHE_FILENAME = '.fix_notebook_metadata.cache.json'
+
+
+def _loads(data):
+    """Parse JSON bytes with orjson when available, stdlib json otherwise."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dumps(nb):
+    """Serialize a notebook to UTF-8 bytes with the nbformat 2-space indent."""
+    if orjson is not None:
+        return orjson.dumps(nb, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(nb, indent=2).encode('utf-8')
+
+
+def _fast_clean_scan(notebook_path):
+    """Scan raw bytes for a widget-state region where every widget has state.
+
+    Memory-maps the notebook, locates the widget-state object and counts
+    '"model_name"' occurrences (one per widget entry) against '"state"'
+    occurrences inside it.  Equal counts mean every widget already carries a
+    state dict, so the expensive JSON parse can be skipped entirely.
+
+    Returns the widget count when the notebook is provably clean, or None
+    when a full parse is needed to decide.
+    """
+    try:
+        with open(notebook_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                marker = mm.find(b'"' + WIDGET_STATE_KEY.encode('ascii') + b'"')
+                if marker < 0:
+                    return None
+                start = mm.find(b'{', marker)
+                if start < 0:
+                    return None
+                # Walk to the matching closing brace with a depth counter.
+                depth = 1
+                pos = start + 1
+                while depth:
+                    opener = mm.find(b'{', pos)
+                    closer = mm.find(b'}', pos)
+                    if closer < 0:
+                        return None
+                    if opener != -1 and opener < closer:
+                        depth += 1
+                        pos = opener + 1
+                    else:
+                        depth -= 1
+                        pos = closer + 1
+                region = mm[start:pos]
+                widgets = region.count(b'"model_name"')
+                states = region.count(b'"state"')
+                if widgets == states:
+                    return widgets
+                return None
+    except (OSError, ValueError):
+        return None
+
+
+def _broken(widget_state):
+    """Yield (widget_id, widget_data) for dict entries missing 'state'."""
+    return ((widget_id, widget_data)
+            for widget_id, widget_data in widget_state.items()
+            if isinstance(widget_data, dict) and 'state' not in widget_data)
+
+
+def check_notebook_widgets(notebook_path):
+    """Check a notebook for widget entries missing the 'state' key.
+
+    Returns a tuple (has_issues, details, nb) where details describes the
+    problems found (or the error that prevented checking) and nb is the
+    parsed notebook, or None when no parse was needed or possible.
+    """
+    widgets = _fast_clean_scan(notebook_path)
+    if widgets is not None:
+        return False, {'widgets': widgets, 'missing_state': []}, None
+
+    try:
+        with open(notebook_path, 'rb', buffering=1 << 20) as f:
+            data = f.read()
+    except OSError as e:
+        return True, {'error': str(e)}, None
+    try:
+        nb = _loads(data)
+    except _JSONDecodeError as e:
+        return True, {'error': str(e)}, None
+
+    if not isinstance(nb, dict):
+        return True, {'error': 'notebook root is not a JSON object'}, None
+
+    metadata = nb.get('metadata', {})
+    if not isinstance(metadata, dict):
+        return True, {'error': 'metadata is not a JSON object'}, None
+    widgets = metadata.get('widgets')
+    if not widgets:
+        return False, {'widgets': 0, 'missing_state': []}, nb
+    if not isinstance(widgets, dict):
+        return True, {'error': 'metadata.widgets is not a JSON object'}, None
+
+    widget_state = widgets.get(WIDGET_STATE_KEY, {})
+    if not isinstance(widget_state, dict):
+        return True, {'error': 'widget-state value is not a JSON object'}, None
+    missing_state = [widget_id for widget_id, _ in _broken(widget_state)]
+
+    return bool(missing_state), {
+        'widgets': len(widget_state),
+        'missing_state': missing_state,
+    }, nb
+
+
+@functools.lru_cache(maxsize=256)
+def _state_template(model_module, model_module_version, model_name):
+    """Derive the minimal state dict for a (module, version, name) triple.
+
+    Notebooks repeat the same handful of widget models hundreds of times
+    (HBoxModel, FloatProgressModel, ...), so the string munging is cached
+    and each widget just copies the template.
+    """
+    return {
+        '_model_module': model_module,
+        '_model_module_version': model_module_version,
+        '_model_name': model_name,
+        '_view_count': None,
+        '_view_module': (model_module.replace('controls', 'base')
+                         if 'controls' in model_module else model_module),
+        '_view_module_version': model_module_version,
+        '_view_name': (model_name[:-5] + 'View'
+                       if model_name.endswith('Model') else model_name + 'View'),
+    }
+
+
+def _apply_fixes(nb):
+    """Add a minimal 'state' dict to widget entries that lack one.
+
+    Mutates the parsed notebook in place and returns (fixed_count,
+    messages); messages are returned rather than printed so the driver
+    can emit them attributed to the right file.
+    """
+    metadata = nb.get('metadata', {}) if isinstance(nb, dict) else {}
+    widgets = metadata.get('widgets') if isinstance(metadata, dict) else None
+    if not isinstance(widgets, dict):
+        return 0, []
+
+    widget_state = widgets.get(WIDGET_STATE_KEY, {})
+    if not isinstance(widget_state, dict):
+        return 0, []
+
+    fixed_ids = []
+    for widget_id, widget_data in _broken(widget_state):
+        model_module = widget_data.get('model_module', '')
+        model_module_version = widget_data.get('model_module_version', '')
+        model_name = widget_data.get('model_name', '')
+        widget_data['state'] = dict(_state_template(
+            model_module, model_module_version, model_name))
+        fixed_ids.append(widget_id)
+
+    if not fixed_ids:
+        return 0, []
+    # One summary message instead of one per widget.
+    return len(fixed_ids), ['  Fixed widgets: ' + ', '.join(fixed_ids)]
+
+
+def _write_notebook(nb, notebook_path, backup=False):
+    """Back up (optionally) and atomically rewrite a notebook.
+
+    Returns (ok, messages).
+    """
+    messages = []
+    if backup:
+        # Snapshot the original bytes instead of re-serializing the whole
+        # notebook: a hardlink is O(1), and the fallback copy is a single
+        # kernel-level byte copy. Either way the backup is byte-identical
+        # to the file the user had.
+        backup_path = notebook_path + '.bak'
+        try:
+            try:
+                os.link(notebook_path, backup_path)
+            except OSError:
+                shutil.copyfile(notebook_path, backup_path)
+            messages.append(f"  Backup written to {backup_path}")
+        except OSError as e:
+            messages.append(f"Error writing backup {backup_path}: {e}")
+            return False, messages
+
+    # Write to a temp file and os.replace it over the original, so the
+    # hardlinked backup keeps the old bytes and a crash mid-write never
+    # leaves a truncated notebook behind.
+    tmp_path = notebook_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(_dumps(nb))
+        os.replace(tmp_path, notebook_path)
+    except OSError as e:
+        messages.append(f"Error writing {notebook_path}: {e}")
+        return False, messages
+
+    return True, messages
+
+
+def fix_notebook_widgets(notebook_path, backup=False, nb=None):
+    """Fix a notebook on disk, reusing a parsed notebook when provided.
+
+    Returns (fixed_count, messages) where fixed_count is the number of
+    widget entries fixed, or -1 on error.
+    """
+    if nb is None:
+        try:
+            with open(notebook_path, 'rb', buffering=1 << 20) as f:
+                data = f.read()
+        except OSError as e:
+            return -1, [f"Error reading {notebook_path}: {e}"]
+        try:
+            nb = _loads(data)
+        except _JSONDecodeError as e:
+            return -1, [f"Error parsing {notebook_path}: {e}"]
+
+    fixed_count, messages = _apply_fixes(nb)
+    if fixed_count == 0:
+        # No-op: leave the file untouched and create no backup.
+        return 0, messages
+    ok, write_messages = _write_notebook(nb, notebook_path, backup=backup)
+    messages.extend(write_messages)
+    if not ok:
+        return -1, messages
+    return fixed_count, messages
+
+
+def _is_wildcard(pattern):
+    """True when the argument is a glob pattern rather than a literal path."""
+    return any(c in pattern for c in '*?[')
+
+
+def _fingerprint(notebook_path):
+    """Hash of (path, mtime_ns, size), or None when the file cannot be stat'ed.
+
+    Any modification to the file changes the fingerprint, so cache entries
+    never need explicit invalidation.
+    """
+    try:
+        st = os.stat(notebook_path)
+    except OSError:
+        return None
+    key = f'{notebook_path}:{st.st_mtime_ns}:{st.st_size}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _load_cache():
+    """Load the known-clean fingerprint cache, tolerating a missing/bad file."""
+    try:
+        with open(CACHE_FILENAME, 'rb') as f:
+            cache = _loads(f.read())
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _save_cache(cache):
+    try:
+        with open(CACHE_FILENAME, 'wb') as f:
+            f.write(_dumps(cache))
+    except OSError:
+        pass
+
+
+def _expand_one(pattern):
+    """Expand one wildcard pattern into a sorted list of .ipynb paths."""
+    head, _, tail = pattern.rpartition(os.sep)
+    if tail == '*.ipynb' and not _is_wildcard(head):
+        # Common case: list the directory with scandir, which filters on
+        # names alone instead of stat-ing every entry like glob does.
+        try:
+            with os.scandir(head or '.') as entries:
+                names = sorted(e.name for e in entries
+                               if e.name.endswith('.ipynb'))
+        except OSError:
+            return []
+        return [os.path.join(head, name) if head else name for name in names]
+    return sorted(p for p in glob.iglob(pattern) if p.endswith('.ipynb'))
+
+
+def _expand(patterns):
+    """Expand CLI arguments into notebook paths, preserving argument order.
+
+    Patterns are classified as wildcard or literal once up front; wildcards
+    are expanded on a thread pool when there is more than one. Literals
+    pass through unfiltered so a bad path is reported when the worker
+    opens it. Returns (files, unmatched) where unmatched lists wildcard
+    patterns that produced no notebooks.
+    """
+    wildcards = [p for p in patterns if _is_wildcard(p)]
+    if len(wildcards) > 1:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            expanded = dict(zip(wildcards, executor.map(_expand_one, wildcards)))
+    else:
+        expanded = {p: _expand_one(p) for p in wildcards}
+    unmatched = [p for p in wildcards if not expanded[p]]
+    groups = (expanded[p] if p in expanded else [p] for p in patterns)
+    return list(itertools.chain.from_iterable(groups)), unmatched
+
+
+def _process_one(notebook_path, fix=False, backup=False):
+    """Check one notebook and optionally fix it.
+
+    Returns (exit_code, lines) so the driver can print results in input
+    order even when files are processed in parallel.
+    """
+    has_issues, details, nb = check_notebook_widgets(notebook_path)
+    if 'error' in details:
+        return 1, [f"{notebook_path}: ERROR {details['error']}"]
+
+    if not has_issues:
+        return 0, [f"{notebook_path}: OK ({details['widgets']} widgets)"]
+
+    missing = details['missing_state']
+    lines = [f"{notebook_path}: {len(missing)} of {details['widgets']} "
+             f"widgets missing 'state'"]
+    if not fix:
+        return 1, lines
+
+    fixed, messages = fix_notebook_widgets(notebook_path, backup=backup, nb=nb)
+    lines.extend(messages)
+    if fixed < 0:
+        return 1, lines
+    lines.append(f"{notebook_path}: fixed {fixed} widgets")
+    return 0, lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check/fix notebooks whose widget metadata is missing 'state'")
+    parser.add_argument('files', nargs='+', help='notebook files or glob patterns')
+    parser.add_argument('--check', action='store_true',
+                        help='only report problems, do not modify files')
+    parser.add_argument('--fix', action='store_true',
+                        help='repair notebooks in place')
+    parser.add_argument('--backup', action='store_true',
+                        help='keep a .bak copy of each modified notebook')
+    args = parser.parse_args()
+
+    if not args.check and not args.fix:
+        parser.error('pass --check and/or --fix')
+
+    exit_code = 0
+    # Wildcard filtering happens during expansion; bad literal paths
+    # surface when the worker tries to open them, saving a stat per file
+    # here. A pattern matching nothing is an error, not a silent pass.
+    files, unmatched = _expand(args.files)
+    for pattern in unmatched:
+        print(f"No notebooks match: {pattern}")
+        exit_code = 1
+
+    # Skip notebooks whose fingerprint is already recorded as clean, so
+    # repeat runs over an unchanged tree are stat-only.
+    cache = _load_cache()
+    atexit.register(_save_cache, cache)
+    pending = [path for path in files
+               if cache.get(_fingerprint(path)) != 'clean']
+
+    worker = functools.partial(_process_one, fix=args.fix, backup=args.backup)
+    if len(pending) > 1:
+        with ProcessPoolExecutor() as executor:
+            results = list(executor.map(worker, pending, chunksize=4))
+    else:
+        results = [worker(path) for path in pending]
+    outcomes = dict(zip(pending, results))
+
+    for path in files:
+        if path not in outcomes:
+            print(f"{path}: OK (cached)")
+            continue
+        code, lines = outcomes[path]
+        for line in lines:
+            print(line)
+        exit_code = max(exit_code, code)
+        if code == 0:
+            # Fingerprint after processing: a just-fixed notebook is clean
+            # under its new mtime/size.
+            fingerprint = _fingerprint(path)
+            if fingerprint:
+                cache[fingerprint] = 'clean'
+
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()